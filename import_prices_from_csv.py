@@ -3,9 +3,13 @@
 
 import os
 import pandas as pd
+import psycopg
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlmodel import SQLModel, Field, Session, create_engine
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import SQLModel, Field, create_engine
 
 load_dotenv()
 
@@ -24,76 +28,169 @@ COMMODITY_MAP = {
     'XPTUSD': ('XPT', 'Platinum'),
 }
 
+# CSV column → symbol, built once rather than per chunk
+SYMBOL_BY_COLUMN = {col: symbol for col, (symbol, _) in COMMODITY_MAP.items()}
+
 # CSV file path (assume it's in the same directory; adjust if needed)
 CSV_FILE = '.datafiles/commodities_1H.csv'  # Updated path based on your error message
 
+# Format of the CSV 'time' column
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rows per CSV chunk; each chunk is inserted and committed on its own
+CHUNK_SIZE = 200_000
+
+# Only used to create the tables; rows are loaded with COPY over a plain psycopg connection
 engine = create_engine(DATABASE_URL, echo=False)
 
 # ==================== MODELS ====================
-class CommodityPrice(SQLModel, table=True):
-    id: int | None = Field(default=None, primary_key=True)
-    symbol: str = Field(max_length=10, index=True)        # e.g., XAU, BTC, XAG
+class Commodity(SQLModel, table=True):
+    # Names live here once instead of on every commodityprice row
+    symbol: str = Field(max_length=10, primary_key=True)  # e.g., XAU, BTC, XAG
     name: str = Field(max_length=50)                     # Human readable
+
+class CommodityPrice(SQLModel, table=True):
+    # (symbol, fetched_at) primary key keeps each symbol's history together in one index,
+    # which the "latest price at or before T" lookups in price_alerts.py scan backwards
+    symbol: str = Field(max_length=10, primary_key=True, foreign_key="commodity.symbol")  # e.g., XAU, BTC, XAG
     usd_price: float
-    fetched_at: datetime = Field(index=True)  # We'll set this manually from CSV 'time'
+    fetched_at: datetime = Field(primary_key=True)  # We'll set this manually from CSV 'time'
 
-# Create table if it doesn't exist
+# Create tables if they don't exist
 SQLModel.metadata.create_all(engine)
 
+def seed_commodities():
+    """Make sure every imported commodity has its dimension row before prices reference it"""
+    stmt = (
+        pg_insert(Commodity)
+        .values([{"symbol": symbol, "name": name} for symbol, name in COMMODITY_MAP.values()])
+        .on_conflict_do_nothing(index_elements=["symbol"])
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+seed_commodities()
+
+# Partition commodityprice into monthly TimescaleDB chunks so time-bounded queries only
+# touch recent chunks. Done before the import so rows land in chunks directly; falls back
+# to a plain table only where the extension can't be enabled.
+def create_hypertable():
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    except DBAPIError as e:
+        print(f"Warning: TimescaleDB unavailable, commodityprice stays a plain table ({e.orig})")
+        return
+
+    # The extension is there, so a failure here is a real problem (e.g. the table hasn't been
+    # migrated to the (symbol, fetched_at) primary key yet) and must not be backfilled over
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                SELECT create_hypertable(
+                    'commodityprice', 'fetched_at',
+                    chunk_time_interval => INTERVAL '1 month',
+                    if_not_exists => TRUE,
+                    migrate_data => TRUE
+                )
+            """))
+    except DBAPIError as e:
+        raise RuntimeError(f"Failed to convert commodityprice to a hypertable: {e.orig}")
+
+create_hypertable()
+
 # ==================== IMPORT FUNCTION ====================
+# Column order of the tuples written to COPY
+COPY_COLUMNS = ('symbol', 'usd_price', 'fetched_at')
+
+def chunk_to_prices(df: pd.DataFrame, cutoff: datetime) -> pd.DataFrame:
+    """
+    Converts one wide CSV chunk (one column per commodity) into long-form price rows
+    Returns DataFrame with columns COPY_COLUMNS, one row per (symbol, fetched_at)
+    """
+    # read_csv already parsed 'time'; if any value in the chunk failed to parse the column
+    # is left as strings, so coerce it here (bad values become NaT)
+    if not pd.api.types.is_datetime64_any_dtype(df['time']):
+        df['time'] = pd.to_datetime(df['time'], format=TIME_FORMAT, errors='coerce', cache=True)
+    invalid_times = df['time'].isna().sum()
+    if invalid_times:
+        print(f"Skipping {invalid_times} rows with missing or invalid time.")
+
+    # Skip rows at or after the cutoff
+    df = df[df['time'].notna() & (df['time'] < cutoff)]
+
+    # Reshape wide (one column per commodity) to long (one row per price)
+    value_cols = [col for col in COMMODITY_MAP if col in df.columns]
+    long = df.melt(id_vars=['time'], value_vars=value_cols, var_name='col', value_name='usd_price')
+    # Empty cells are skipped silently; present but non-numeric prices are reported
+    present = long['usd_price'].notna()
+    long['usd_price'] = pd.to_numeric(long['usd_price'], errors='coerce')  # No-op for clean float columns
+    invalid_prices = (present & long['usd_price'].isna()).sum()
+    if invalid_prices:
+        print(f"Skipping {invalid_prices} invalid prices.")
+    long = long.dropna(subset=['usd_price'])
+
+    long['symbol'] = long['col'].map(SYMBOL_BY_COLUMN)
+    long = long.rename(columns={'time': 'fetched_at'})
+
+    return long[list(COPY_COLUMNS)]
+
 def import_from_csv():
     print(f"\n=== Importing from {CSV_FILE} @ {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%SZ')} ===\n")
 
-    # Read CSV using pandas
-    try:
-        df = pd.read_csv(CSV_FILE)
-        print(f"Loaded CSV with {len(df)} rows.")
-    except Exception as e:
-        raise RuntimeError(f"Failed to read CSV: {e}")
-
     # Define cutoff datetime
     cutoff = datetime(2025, 12, 30, 15, 0, 0)
 
-    # Prepare list of dict entries (for bulk_insert_mappings)
-    entries = []
-    for _, row in df.iterrows():
-        time_str = row['time']
-        if pd.isna(time_str):
-            print(f"Skipping row with missing time: {row}")
-            continue
+    total_rows = 0
+    total_inserted = 0
+
+    copy_columns = ', '.join(COPY_COLUMNS)
+
+    # Stream the CSV in chunks so memory stays bounded by CHUNK_SIZE, committing each batch
+    with psycopg.connect(DATABASE_URL) as conn:
+        # COPY has no ON CONFLICT, so rows are copied into a staging table (emptied on every
+        # commit) and moved across with INSERT ... ON CONFLICT DO NOTHING to skip duplicates
+        conn.execute("""
+            CREATE TEMP TABLE commodityprice_staging
+            (LIKE commodityprice INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+        """)
         try:
-            fetched_at = datetime.strptime(str(time_str), '%Y-%m-%d %H:%M:%S')
-        except (ValueError, TypeError) as e:
-            print(f"Skipping row with invalid time: {time_str} ({e})")
-            continue
-
-        # Skip rows at or after the cutoff
-        if fetched_at >= cutoff:
-            continue
-
-        for col, (symbol, name) in COMMODITY_MAP.items():
-            if col in df.columns and pd.notna(row[col]):
-                try:
-                    usd_price = float(row[col])
-                    entry = {
-                        'symbol': symbol,
-                        'name': name,
-                        'usd_price': usd_price,
-                        'fetched_at': fetched_at
-                    }
-                    entries.append(entry)
-                except ValueError:
-                    print(f"Skipping invalid price for {symbol} at {time_str}")
-
-    if not entries:
+            reader = pd.read_csv(
+                CSV_FILE,
+                chunksize=CHUNK_SIZE,
+                usecols=lambda col: col == 'time' or col in COMMODITY_MAP,  # Skip non-commodity columns
+                parse_dates=['time'],
+                date_format=TIME_FORMAT,
+            )
+            for df in reader:
+                total_rows += len(df)
+                prices = chunk_to_prices(df, cutoff)
+                if prices.empty:
+                    continue
+
+                # COPY skips per-row INSERT parsing/planning entirely
+                with conn.cursor() as cur:
+                    with cur.copy(f"COPY commodityprice_staging ({copy_columns}) FROM STDIN") as copy:
+                        # Stream rows straight from the DataFrame; no intermediate Python list
+                        for row in prices.itertuples(index=False, name=None):
+                            copy.write_row(row)
+                    cur.execute(f"""
+                        INSERT INTO commodityprice ({copy_columns})
+                        SELECT {copy_columns} FROM commodityprice_staging
+                        ON CONFLICT DO NOTHING
+                    """)
+                    inserted = cur.rowcount
+                conn.commit()
+                total_inserted += inserted
+                print(f"Inserted {inserted} of {len(prices)} records ({total_inserted} so far).")
+        except (OSError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            raise RuntimeError(f"Failed to read CSV: {e}")
+
+    print(f"Loaded CSV with {total_rows} rows.")
+    if not total_inserted:
         print("No valid data to import.")
         return
-
-    # Bulk insert using mappings (avoids RETURNING/sentinel issues)
-    with Session(engine) as session:
-        session.bulk_insert_mappings(CommodityPrice, entries)
-        session.commit()
-    print(f"Inserted {len(entries)} records.")
+    print(f"Inserted {total_inserted} records.")
 
 # ==================== MAIN ====================
 if __name__ == "__main__":
@@ -1,87 +1,105 @@
 import os
 import requests
-import psycopg
+from psycopg_pool import ConnectionPool
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from datetime import timezone  # Important!
 
 load_dotenv()
 
+# Module-level pool so warm Cloud Function instances reuse their Neon connection;
+# check_connection drops connections the server closed while the instance was idle
+POOL = ConnectionPool(
+    os.environ['DATABASE_URL'],
+    min_size=1,
+    max_size=3,
+    check=ConnectionPool.check_connection,
+    open=True,
+)
+
+# Commodities to check (same symbols update_prices.py stores); avoids a DISTINCT scan of commodityprice
+SYMBOLS = ["XAU", "XAG", "XPT", "XPD", "BTC", "HG"]
+
+# Telegram Markdown body for one triggered alert
+ALERT_TEMPLATE = (
+    "\n{emoji} *{name}* moved *{pct_change:.2f}%* {direction} in the last {period}\n\n"
+    "   • Old price: ${old_price:,.2f}\n"
+    "   • New price: ${new_price:,.2f}\n"
+    "   • {label} alert ≥ {min_pct}%"
+)
+
 def fetch_and_save_prices(request):  # GCF HTTP trigger entry point
 
-    conn_string = os.environ['DATABASE_URL']
     bot_token = os.environ['TELEGRAM_BOT_TOKEN']
     chat_id = os.environ['TELEGRAM_CHAT_ID']
 
     alerts = []
+    sent_alerts = []  # (symbol, label, sent_at) rows to upsert into sent_alerts
 
     # Use timezone-aware UTC now
     current_time = datetime.now(timezone.utc)
 
-    with psycopg.connect(conn_string) as conn:
+    # Define thresholds
+    thresholds = [
+        {"period": "1 day",   "days": 1,  "pct": 2,  "label": "daily"},
+        {"period": "1 week",  "days": 7,  "pct": 5,  "label": "weekly"},
+        {"period": "1 month", "days": 30, "pct": 10, "label": "monthly"},
+    ]
+
+    # One LATERAL lookup per threshold: latest price at or before that threshold's cutoff
+    historical_joins = "".join(
+        f"""
+                LEFT JOIN LATERAL (
+                    SELECT usd_price FROM commodityprice
+                    WHERE symbol = s.symbol
+                      AND fetched_at <= %s
+                    ORDER BY fetched_at DESC LIMIT 1
+                ) {thresh['label']} ON true"""
+        for thresh in thresholds
+    )
+    historical_cols = "".join(f", {thresh['label']}.usd_price" for thresh in thresholds)
+
+    # Calculate cutoffs for historical prices (also timezone-aware)
+    cutoff_timestamps = [current_time - timedelta(days=thresh['days']) for thresh in thresholds]
+
+    with POOL.connection() as conn:
         with conn.cursor() as cur:
 
-            # Get unique commodities
-            cur.execute("SELECT DISTINCT symbol FROM commodityprice")
-            commodity_names = [row[0] for row in cur.fetchall()]
+            # Current and historical prices for every commodity in a single round-trip
+            # (symbols with no rows yet are dropped by the CROSS JOIN). The hot queries are
+            # prepared server-side so pooled connections on warm instances skip parse/plan.
+            cur.execute(f"""
+                SELECT s.symbol, latest.usd_price{historical_cols}
+                FROM unnest(%s::text[]) AS s(symbol)
+                CROSS JOIN LATERAL (
+                    SELECT usd_price FROM commodityprice
+                    WHERE symbol = s.symbol
+                    ORDER BY fetched_at DESC LIMIT 1
+                ) latest{historical_joins}
+            """, [SYMBOLS, *cutoff_timestamps], prepare=True)
+            price_rows = cur.fetchall()
 
-            # Define thresholds
-            thresholds = [
-                {"period": "1 day",   "days": 1,  "pct": 2,  "label": "daily"},
-                {"period": "1 week",  "days": 7,  "pct": 5,  "label": "weekly"},
-                {"period": "1 month", "days": 30, "pct": 10, "label": "monthly"},
-            ]
+            # When each alert type was last sent, keyed by (symbol, label)
+            cur.execute("SELECT symbol, label, last_sent_at FROM sent_alerts", prepare=True)
+            last_sent = {(row[0], row[1]): row[2] for row in cur.fetchall()}
 
-            for name in commodity_names:
+            for name, current_price, *old_prices in price_rows:
 
                 print(f"Processing {name}")
 
-                # Get current (latest) price
-                cur.execute("""
-                    SELECT usd_price FROM commodityprice
-                    WHERE symbol = %s
-                    ORDER BY fetched_at DESC LIMIT 1
-                """, (name,))
-                current_price_row = cur.fetchone()
-                if not current_price_row:
-                    continue
-                current_price = current_price_row[0]
-
-                for thresh in thresholds:
+                for thresh, old_price in zip(thresholds, old_prices):
 
                     label = thresh['label']
 
                     cooldown_period = timedelta(days=thresh['days'])
 
                     # Check when this alert type was last sent
-                    cur.execute("""
-                        SELECT last_sent_at FROM sent_alerts
-                        WHERE symbol = %s AND label = %s
-                    """, (name, label))
-                    last_sent_row = cur.fetchone()
-
-                    if last_sent_row:
-                        last_sent_at = last_sent_row[0]  # This is timezone-aware (TIMESTAMPTZ)
-                        if current_time - last_sent_at < cooldown_period:
-                            print(f"  Skipping {name} {label} alert - cooldown active")
-                            continue
-
-                    # Calculate cutoff for historical price (also timezone-aware)
-                    cutoff_timestamp = current_time - cooldown_period
-
-                    cur.execute("""
-                        SELECT usd_price FROM commodityprice
-                        WHERE symbol = %s
-                          AND fetched_at <= %s
-                        ORDER BY fetched_at DESC LIMIT 1
-                    """, (name, cutoff_timestamp))
-                    old_price_row = cur.fetchone()
-
-                    if not old_price_row:
+                    last_sent_at = last_sent.get((name, label))  # This is timezone-aware (TIMESTAMPTZ)
+                    if last_sent_at and current_time - last_sent_at < cooldown_period:
+                        print(f"  Skipping {name} {label} alert - cooldown active")
                         continue
-                    old_price = old_price_row[0]
 
-                    if old_price == 0:
+                    if old_price is None or old_price == 0:
                         continue
 
                     pct_change = (current_price - old_price) / old_price * 100
@@ -90,25 +108,34 @@ def fetch_and_save_prices(request):  # GCF HTTP trigger entry point
                         direction = "up" if pct_change > 0 else "down"
                         emoji = "📈" if direction == "up" else "📉"
 
-                        alert_lines = [
-                            f"\n{emoji} *{name}* moved *{abs(pct_change):.2f}%* {direction} "
-                            f"in the last {thresh['period']}\n",
-                            f"   • Old price: ${old_price:,.2f}",
-                            f"   • New price: ${current_price:,.2f}",
-                            f"   • {thresh['label']} alert ≥ {thresh['pct']}%"
-                        ]
-
-                        alerts.append("\n".join(alert_lines))
-
-                        # Record/update the alert sent time (timezone-aware)
+                        alerts.append(ALERT_TEMPLATE.format(
+                            emoji=emoji,
+                            name=name,
+                            pct_change=abs(pct_change),
+                            direction=direction,
+                            period=thresh['period'],
+                            old_price=old_price,
+                            new_price=current_price,
+                            label=thresh['label'],
+                            min_pct=thresh['pct'],
+                        ))
+
+                        # Queue the alert sent time (timezone-aware); written after the loop
+                        sent_alerts.append((name, label, current_time))
+
+                        print(f"  Alert triggered for {name} {label}")
+
+            # Record/update all alert sent times in one pipelined network exchange
+            if sent_alerts:
+                with conn.pipeline():
+                    for sent_alert in sent_alerts:
                         cur.execute("""
                             INSERT INTO sent_alerts (symbol, label, last_sent_at)
                             VALUES (%s, %s, %s)
                             ON CONFLICT (symbol, label) DO UPDATE
                             SET last_sent_at = EXCLUDED.last_sent_at
-                        """, (name, label, current_time))
-
-                        print(f"  Alert triggered and recorded for {name} {label}")
+                        """, sent_alert)
+                print(f"Recorded {len(sent_alerts)} sent alerts")
 
             # Commit all sent_alerts updates
             conn.commit()
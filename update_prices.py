@@ -2,8 +2,11 @@
 
 import os
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from datetime import date, datetime
 from dotenv import load_dotenv
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlmodel import SQLModel, Field, Session, create_engine, select
 from flask import abort
 
@@ -34,15 +37,34 @@ COMMODITIES = {
     "HG": "Copper (per pound)",  # HG = Copper futures symbol
 }
 
-engine = create_engine(DATABASE_URL, echo=False)
+# psycopg2 fast-execution helpers: batch executemany INSERTs into multi-VALUES statements
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    executemany_mode="values_plus_batch",
+    insertmanyvalues_page_size=10000,
+    executemany_batch_page_size=500,
+)
+
+# Shared HTTP session: keep-alive and connection pooling across requests (and warm invocations)
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+# UTC date metalpriceapi.com last answered 429; survives between invocations on a warm instance
+_platinum_quota_exhausted_on: date | None = None
 
 # ==================== MODELS ====================
-class CommodityPrice(SQLModel, table=True):
-    id: int | None = Field(default=None, primary_key=True)
-    symbol: str = Field(max_length=10, index=True)        # e.g., XAU, BTC, XAG
+class Commodity(SQLModel, table=True):
+    # Names live here once instead of on every commodityprice row
+    symbol: str = Field(max_length=10, primary_key=True)  # e.g., XAU, BTC, XAG
     name: str = Field(max_length=50)                     # Human readable
+
+class CommodityPrice(SQLModel, table=True):
+    # (symbol, fetched_at) primary key keeps each symbol's history together in one index,
+    # which the "latest price at or before T" lookups in price_alerts.py scan backwards
+    symbol: str = Field(max_length=10, primary_key=True, foreign_key="commodity.symbol")  # e.g., XAU, BTC, XAG
     usd_price: float
-    fetched_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    fetched_at: datetime = Field(default_factory=datetime.utcnow, primary_key=True)
 
 class FXRate(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
@@ -53,6 +75,18 @@ class FXRate(SQLModel, table=True):
 # Create tables if they don't exist
 SQLModel.metadata.create_all(engine)
 
+def seed_commodities():
+    """Make sure every tracked commodity has its dimension row before prices reference it"""
+    stmt = (
+        pg_insert(Commodity)
+        .values([{"symbol": symbol, "name": name} for symbol, name in COMMODITIES.items()])
+        .on_conflict_do_nothing(index_elements=["symbol"])
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+seed_commodities()
+
 # ==================== CORE FUNCTIONS ====================
 def fetch_commodity_prices() -> dict:
     """
@@ -61,25 +95,31 @@ def fetch_commodity_prices() -> dict:
     """
     prices = {}
     base_url = "https://api.gold-api.com/price"
-
-    for symbol in COMMODITIES.keys():
-        if symbol == "XPT":  # Skip platinum – handled separately
-            continue
-        try:
-            resp = requests.get(f"{base_url}/{symbol}", timeout=10)
-            if resp.status_code == 404:
-                print(f"Warning: Symbol {symbol} not supported by gold-api.com (yet?)")
-                continue
-            resp.raise_for_status()
-            data = resp.json()
-            price = data.get("price")
-            if price is not None:
-                prices[symbol] = float(price)
-                print(f"Fetched {COMMODITIES[symbol]} ({symbol}): ${price:,.2f}")
-            else:
-                print(f"Warning: No price data for {symbol}")
-        except Exception as e:
-            print(f"Error fetching {symbol}: {e}")
+    symbols = [symbol for symbol in COMMODITIES if symbol != "XPT"]  # Skip platinum – handled separately
+
+    # Requests are I/O-bound, so fetch all symbols concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = {
+            executor.submit(HTTP_SESSION.get, f"{base_url}/{symbol}", timeout=10): symbol
+            for symbol in symbols
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                resp = future.result()
+                if resp.status_code == 404:
+                    print(f"Warning: Symbol {symbol} not supported by gold-api.com (yet?)")
+                    continue
+                resp.raise_for_status()
+                data = resp.json()
+                price = data.get("price")
+                if price is not None:
+                    prices[symbol] = float(price)
+                    print(f"Fetched {COMMODITIES[symbol]} ({symbol}): ${price:,.2f}")
+                else:
+                    print(f"Warning: No price data for {symbol}")
+            except Exception as e:
+                print(f"Error fetching {symbol}: {e}")
 
     return prices
 
@@ -88,6 +128,8 @@ def fetch_platinum_price() -> dict:
     Fetches latest USD price for platinum (XPT) from metalpriceapi.com
     Returns dict like: {"XPT": price} or empty dict on failure
     """
+    global _platinum_quota_exhausted_on
+
     symbol = "XPT"
     prices = {}
     base_url = "https://api.metalpriceapi.com/v1/latest"
@@ -97,6 +139,11 @@ def fetch_platinum_price() -> dict:
         print("Error: METAL_PRICE_API_KEY not set in .env")
         return prices
 
+    today = datetime.utcnow().date()
+    if _platinum_quota_exhausted_on == today:
+        print(f"Skipping {symbol}: metalpriceapi.com quota exhausted for today")
+        return prices
+
     params = {
         "api_key": api_key,
         "base": "USD",
@@ -104,7 +151,11 @@ def fetch_platinum_price() -> dict:
     }
 
     try:
-        resp = requests.get(base_url, params=params, timeout=10)
+        resp = HTTP_SESSION.get(base_url, params=params, timeout=10)
+        if resp.status_code == 429:
+            _platinum_quota_exhausted_on = today
+            print(f"Error: metalpriceapi.com quota exhausted, skipping {symbol} until tomorrow (UTC)")
+            return prices
         resp.raise_for_status()
         data = resp.json()
         
@@ -129,15 +180,16 @@ def save_commodity_prices(price_dict: dict):
         print("No commodity prices to save.")
         return
 
-    with Session(engine) as session:
-        for symbol, usd_price in price_dict.items():
-            entry = CommodityPrice(
-                symbol=symbol,
-                name=COMMODITIES[symbol],
-                usd_price=usd_price,
-            )
-            session.add(entry)
-        session.commit()
+    fetched_at = datetime.utcnow()
+    entries = [
+        {"symbol": symbol, "usd_price": usd_price, "fetched_at": fetched_at}
+        for symbol, usd_price in price_dict.items()
+    ]
+
+    # Single batched Core INSERT for all symbols (no ORM unit of work); a repeat
+    # (symbol, fetched_at) is skipped
+    with engine.begin() as conn:
+        conn.execute(pg_insert(CommodityPrice).on_conflict_do_nothing(), entries)
     print(f"Saved {len(price_dict)} commodity prices.")
 
 def save_all_fx_rates():
@@ -145,7 +197,7 @@ def save_all_fx_rates():
     print(f"Updating FX rates @ {datetime.utcnow().isoformat()}Z")
 
     try:
-        resp = requests.get(
+        resp = HTTP_SESSION.get(
             f"https://v6.exchangerate-api.com/v6/{EXCHANGE_API_KEY}/latest/USD",
             timeout=12
         )